@@ -1,5 +1,12 @@
+// The left/right chains, the bottom row and the background trace/cache writes
+// all share libuv's threadpool (sharp pipelines and fs calls alike). The
+// default of 4 lets a burst of file writes queue the next slide behind it, so
+// reserve more slots. Must be set before anything touches the pool.
+process.env.UV_THREADPOOL_SIZE = process.env.UV_THREADPOOL_SIZE || '8';
+
 const path = require('path');
 const fs = require('fs');
+const crypto = require('crypto');
 const express = require('express');
 const multer = require('multer');
 const sharp = require('sharp');
@@ -17,6 +24,40 @@ const ACCELERATION = 'none';
 const OUTPUT_FORMAT = 'jpeg';
 const GUIDANCE_SCALE = 2.5;
 const ITERATIONS = 3;
+const WHITE = Object.freeze({ r: 255, g: 255, b: 255 });
+// Contexts sent to FAL are JPEG: the LoRA was trained on JPEG pairs, and the
+// upload is several times smaller than the equivalent PNG. 4:4:4 keeps the
+// edge between the image and the blank band sharp.
+const CONTEXT_JPEG_OPTIONS = { quality: 95, chromaSubsampling: '4:4:4' };
+const RESIZE_SMALL_DELTA = 0.05;
+// The stitched world is made of JPEG FAL results already, so returning it as
+// JPEG loses nothing visible and is far cheaper to encode and ship than PNG.
+const OUTPUT_JPEG_OPTIONS = { quality: 92, chromaSubsampling: '4:4:4', progressive: true };
+// libjpeg rejects anything wider or taller than this (its JPEG_MAX_DIMENSION,
+// below the format's own 65535); very long runs fall back to PNG rather than
+// failing after every FAL call has been paid for.
+const JPEG_MAX_DIMENSION = 65500;
+// Bands, tiles and the left canvas are only decoded again by this process
+// (or dumped to the trace/cache dirs), so size matters far less than the
+// deflate time; level 1 encodes several times faster than the default 6.
+const INTERMEDIATE_PNG_OPTIONS = { compressionLevel: 1 };
+const DOWNLOAD_TIMEOUT_MS = 60000;
+const UPLOAD_CACHE_LIMIT = 256;
+const RETRY_ATTEMPTS = 6;
+const RETRY_BASE_DELAY_MS = 1000;
+const RETRY_MAX_DELAY_MS = 30000;
+const RETRYABLE_NETWORK_CODES = ['ECONNRESET', 'ECONNREFUSED', 'ETIMEDOUT', 'EAI_AGAIN', 'UND_ERR_SOCKET'];
+
+// enabled: read + write, replay: read only (misses fail), write-only: refresh
+// entries without reading them, disabled: bypass the cache entirely.
+const FAL_CACHE_MODES = ['enabled', 'replay', 'write-only', 'disabled'];
+// Relative paths are taken from the repo root, like .env, not from whichever
+// directory the server happens to be started in.
+const FAL_CACHE_DIR = path.resolve(__dirname, '..', process.env.FAL_CACHE_DIR || 'cache');
+// Off by default: a cached result would hand back the same world for the same
+// seed, so the cache is an opt-in for development runs.
+const FAL_CACHE_MODE = process.env.FAL_CACHE_MODE || 'disabled';
+const TRACE_DIR = process.env.TRACE_DIR ? path.resolve(__dirname, '..', process.env.TRACE_DIR) : null;
 
 const TEXT_TO_IMAGE_MODEL = 'fal-ai/flux-pro/v1.1-ultra';
 const DEFAULT_TEXT_PROMPT =
@@ -26,8 +67,20 @@ if (!process.env.FAL_KEY) {
   console.warn('FAL_KEY is not set. API calls will fail until it is configured.');
 }
 
+if (!FAL_CACHE_MODES.includes(FAL_CACHE_MODE)) {
+  throw new Error(`Invalid FAL_CACHE_MODE "${FAL_CACHE_MODE}", expected one of: ${FAL_CACHE_MODES.join(', ')}`);
+}
+
+// The SDK already retries 429/502/503/504 on submit, status polls and storage
+// uploads, so its policy is tuned here rather than wrapped again: re-running a
+// whole subscribe would re-submit (and re-bill) a job that may still be running.
 fal.config({
   credentials: process.env.FAL_KEY,
+  retry: {
+    maxRetries: RETRY_ATTEMPTS - 1,
+    baseDelay: RETRY_BASE_DELAY_MS,
+    maxDelay: RETRY_MAX_DELAY_MS,
+  },
 });
 
 const app = express();
@@ -39,25 +92,31 @@ const upload = multer({
 
 app.use(express.json({ limit: '1mb' }));
 
-function createWhiteBackground(width, height) {
-  return sharp({
-    create: {
-      width,
-      height,
-      channels: 3,
-      background: { r: 255, g: 255, b: 255 },
-    },
-  });
+function isRgbPng(metadata) {
+  return metadata.format === 'png' && metadata.space === 'srgb' && metadata.channels === 3;
 }
 
 async function ensureRgbPng(buffer) {
-  return sharp(buffer).toColourspace('srgb').png().toBuffer();
+  const image = sharp(buffer);
+  if (isRgbPng(await image.metadata())) {
+    return buffer;
+  }
+
+  // Drop any alpha channel up front so every downstream buffer is 3 bytes per
+  // pixel and composites never have to blend through a mask.
+  return image
+    .flatten({ background: WHITE })
+    .toColourspace('srgb')
+    .png()
+    .toBuffer();
 }
 
-async function slideImageLeft(buffer) {
+// The slide and extract helpers accept the buffer's size when the caller
+// already knows it (every context in a chain shares the seed's size), which
+// skips re-reading the header on each step.
+async function slideImageLeft(buffer, knownSize) {
   const image = sharp(buffer);
-  const metadata = await image.metadata();
-  const { width, height } = metadata;
+  const { width, height } = knownSize || (await image.metadata());
 
   if (!width || !height) {
     throw new Error('Invalid image dimensions');
@@ -71,31 +130,19 @@ async function slideImageLeft(buffer) {
     throw new Error('Image width is too small to split into thirds');
   }
 
-  const middleSlice = await image
-    .clone()
-    .extract({ left: col1End, top: 0, width: col2End - col1End, height })
-    .png()
-    .toBuffer();
-
-  const rightSlice = await image
-    .clone()
-    .extract({ left: col2End, top: 0, width: thirdWidth, height })
-    .png()
-    .toBuffer();
-
-  return createWhiteBackground(width, height)
-    .composite([
-      { input: middleSlice, left: 0, top: 0 },
-      { input: rightSlice, left: col1End, top: 0 },
-    ])
-    .png()
+  // Keep the last col2End columns and pad exactly thirdWidth of white, so the
+  // blank band lines up with what extractRightThird takes back out (unless
+  // the width is a multiple of 3, a col1End-wide band misaligns every seam).
+  return image
+    .extract({ left: width - col2End, top: 0, width: col2End, height })
+    .extend({ right: thirdWidth, background: WHITE })
+    .jpeg(CONTEXT_JPEG_OPTIONS)
     .toBuffer();
 }
 
-async function slideImageRight(buffer) {
+async function slideImageRight(buffer, knownSize) {
   const image = sharp(buffer);
-  const metadata = await image.metadata();
-  const { width, height } = metadata;
+  const { width, height } = knownSize || (await image.metadata());
 
   if (!width || !height) {
     throw new Error('Invalid image dimensions');
@@ -110,31 +157,21 @@ async function slideImageRight(buffer) {
     throw new Error('Image width is too small to split into thirds');
   }
 
-  const leftSlice = await image
-    .clone()
-    .extract({ left: 0, top: 0, width: leftWidth, height })
-    .png()
-    .toBuffer();
-
-  const middleSlice = await image
-    .clone()
-    .extract({ left: col1End, top: 0, width: col2End - col1End, height })
-    .png()
-    .toBuffer();
-
-  return createWhiteBackground(width, height)
-    .composite([
-      { input: leftSlice, left: rightWidth, top: 0 },
-      { input: middleSlice, left: rightWidth + leftWidth, top: 0 },
-    ])
-    .png()
+  // Mirror of slideImageLeft: pad exactly the col1End columns that
+  // extractLeftThird takes back out, keeping the first width - col1End.
+  return image
+    .extract({ left: 0, top: 0, width: width - col1End, height })
+    .extend({ left: leftWidth, background: WHITE })
+    .jpeg(CONTEXT_JPEG_OPTIONS)
     .toBuffer();
 }
 
-async function extractRightThird(buffer) {
+// Columns are returned as raw { data, info } pixels: they are only ever
+// composited into the stitched canvas, so PNG encoding them would be a wasted
+// encode/decode round trip per step.
+async function extractRightThird(buffer, knownSize) {
   const image = sharp(buffer);
-  const metadata = await image.metadata();
-  const { width, height } = metadata;
+  const { width, height } = knownSize || (await image.metadata());
 
   if (!width || !height) {
     throw new Error('Invalid image dimensions');
@@ -149,15 +186,14 @@ async function extractRightThird(buffer) {
 
   return image
     .extract({ left: col2End, top: 0, width: thirdWidth, height })
-    .png()
-    .toBuffer();
+    .raw()
+    .toBuffer({ resolveWithObject: true });
 }
 
 
-async function slideImageUp(buffer) {
+async function slideImageUp(buffer, knownSize) {
   const image = sharp(buffer);
-  const metadata = await image.metadata();
-  const { width, height } = metadata;
+  const { width, height } = knownSize || (await image.metadata());
 
   if (!width || !height) {
     throw new Error('Invalid image dimensions');
@@ -170,22 +206,16 @@ async function slideImageUp(buffer) {
     throw new Error('Image height is too small to slide up');
   }
 
-  const topPortion = await image
-    .clone()
+  return image
     .extract({ left: 0, top: 0, width, height: keepHeight })
-    .png()
-    .toBuffer();
-
-  return createWhiteBackground(width, height)
-    .composite([{ input: topPortion, left: 0, top: 0 }])
-    .png()
+    .extend({ bottom: tileHeight, background: WHITE })
+    .jpeg(CONTEXT_JPEG_OPTIONS)
     .toBuffer();
 }
 
-async function extractBottomThird(buffer) {
+async function extractBottomThird(buffer, knownSize) {
   const image = sharp(buffer);
-  const metadata = await image.metadata();
-  const { width, height } = metadata;
+  const { width, height } = knownSize || (await image.metadata());
 
   if (!width || !height) {
     throw new Error('Invalid image dimensions');
@@ -200,48 +230,45 @@ async function extractBottomThird(buffer) {
 
   return image
     .extract({ left: 0, top: row2End, width, height: bandHeight })
-    .png()
+    .png(INTERMEDIATE_PNG_OPTIONS)
     .toBuffer();
 }
 
-async function compositeBottomSegment(baseBuffer, segmentBuffer, left, top) {
-  const baseImage = sharp(baseBuffer);
-  const baseMeta = await baseImage.metadata();
+async function bottomSegmentOverlay(segmentBuffer, left, top, canvasWidth, canvasHeight) {
   const segmentMeta = await sharp(segmentBuffer).metadata();
 
-  if (!baseMeta.width || !baseMeta.height) {
-    throw new Error('Invalid base image dimensions');
-  }
   if (!segmentMeta.width || !segmentMeta.height) {
-    return baseBuffer;
+    return null;
   }
 
-  const maxWidth = baseMeta.width;
-  let effectiveLeft = Math.max(0, Math.min(left, Math.max(0, maxWidth - segmentMeta.width)));
-  let segment = segmentBuffer;
-  let segmentWidth = segmentMeta.width;
+  const effectiveLeft = Math.max(0, Math.min(left, Math.max(0, canvasWidth - segmentMeta.width)));
+  const clampedWidth = Math.min(segmentMeta.width, Math.max(0, canvasWidth - effectiveLeft));
+  const clampedHeight = Math.min(segmentMeta.height, Math.max(0, canvasHeight - top));
+  if (clampedWidth === 0 || clampedHeight === 0) {
+    return null;
+  }
 
-  if (effectiveLeft + segmentWidth > maxWidth) {
-    const clampedWidth = Math.max(0, maxWidth - effectiveLeft);
-    if (clampedWidth === 0) {
-      return baseBuffer;
-    }
-    segment = await sharp(segmentBuffer)
-      .extract({ left: 0, top: 0, width: clampedWidth, height: segmentMeta.height })
-      .png()
-      .toBuffer();
-    segmentWidth = clampedWidth;
+  if (clampedWidth === segmentMeta.width && clampedHeight === segmentMeta.height) {
+    return { input: segmentBuffer, left: effectiveLeft, top };
   }
 
-  return sharp(baseBuffer)
-    .composite([{ input: segment, left: effectiveLeft, top }])
-    .png()
-    .toBuffer();
+  // Hand the clamped strip over as raw pixels so it is not PNG encoded only
+  // to be decoded again by the final composite.
+  const { data, info } = await sharp(segmentBuffer)
+    .extract({ left: 0, top: 0, width: clampedWidth, height: clampedHeight })
+    .raw()
+    .toBuffer({ resolveWithObject: true });
+  return {
+    input: data,
+    raw: { width: info.width, height: info.height, channels: info.channels },
+    left: effectiveLeft,
+    top,
+  };
 }
-async function extractLeftThird(buffer) {
+
+async function extractLeftThird(buffer, knownSize) {
   const image = sharp(buffer);
-  const metadata = await image.metadata();
-  const { width, height } = metadata;
+  const { width, height } = knownSize || (await image.metadata());
 
   if (!width || !height) {
     throw new Error('Invalid image dimensions');
@@ -255,230 +282,280 @@ async function extractLeftThird(buffer) {
 
   return image
     .extract({ left: 0, top: 0, width: leftWidth, height })
-    .png()
-    .toBuffer();
+    .raw()
+    .toBuffer({ resolveWithObject: true });
 }
 
-async function extractBottomTile(columnBuffer, tileHeight) {
-  const image = sharp(columnBuffer);
-  const metadata = await image.metadata();
-  const { width, height } = metadata;
+async function extractBottomRightTile(buffer, tileHeight, knownSize) {
+  const image = sharp(buffer);
+  const { width, height } = knownSize || (await image.metadata());
 
   if (!width || !height) {
-    throw new Error('Invalid column dimensions');
+    throw new Error('Invalid image dimensions');
   }
 
+  const col2End = Math.floor((2 * width) / 3);
+  const thirdWidth = width - col2End;
   const bandHeight = Math.min(tileHeight, height);
   const top = Math.max(0, height - bandHeight);
 
+  if (thirdWidth <= 0) {
+    throw new Error('Failed to compute right third width');
+  }
+
+  // Crop the new tile straight out of the FAL result instead of encoding the
+  // whole right column first and cropping that again.
   return image
-    .extract({ left: 0, top, width, height: bandHeight })
-    .png()
+    .extract({ left: col2End, top, width: thirdWidth, height: bandHeight })
+    .png(INTERMEDIATE_PNG_OPTIONS)
     .toBuffer();
 }
 
-async function extendBottomRow(baseBuffer, seedMeta, steps) {
-  const baseMeta = await sharp(baseBuffer).metadata();
+async function extendBottomRow(leftBuffer, finalWidth, seedMeta, trace, signal, knownSize) {
+  const leftMeta = knownSize || (await sharp(leftBuffer).metadata());
   const seedWidth = seedMeta.width || 0;
   const seedHeight = seedMeta.height || 0;
-  const finalWidth = baseMeta.width || 0;
-  const finalHeight = baseMeta.height || 0;
+  const finalHeight = leftMeta.height || 0;
 
   const tileWidth = Math.floor(seedWidth / 3);
   const tileHeight = Math.floor(seedHeight / 3);
 
   if (!finalWidth || !finalHeight || tileWidth <= 0 || tileHeight <= 0) {
-    return baseBuffer;
+    return null;
   }
 
-  const blockWidth = Math.min(tileWidth * 3, finalWidth);
+  const blockWidth = Math.min(tileWidth * 3, finalWidth, leftMeta.width || 0);
   if (blockWidth <= 0) {
-    return baseBuffer;
+    return null;
   }
 
-  let workingBuffer = await createWhiteBackground(finalWidth, finalHeight + tileHeight)
-    .composite([{ input: baseBuffer, left: 0, top: 0 }])
-    .png()
-    .toBuffer();
+  const steps = [];
+  const segments = [];
 
-  let context = await sharp(workingBuffer)
+  let context = await sharp(leftBuffer)
     .extract({ left: 0, top: 0, width: blockWidth, height: finalHeight })
-    .png()
+    .png(INTERMEDIATE_PNG_OPTIONS)
     .toBuffer();
 
-  const contextMeta = await sharp(context).metadata();
-  const verticalExpected = { width: contextMeta.width || 0, height: contextMeta.height || 0 };
+  // Every context in this row is a blockWidth x finalHeight window and every
+  // new tile is the right third of one, so the sizes are known up front
+  // instead of being read back from each intermediate buffer.
+  const contextSize = { width: blockWidth, height: finalHeight };
+  const tileStride = blockWidth - Math.floor((2 * blockWidth) / 3);
 
-  const slidUp = await slideImageUp(context);
-  const falVertical = await callFal(slidUp, verticalExpected);
-  const bottomBand = await extractBottomThird(falVertical);
+  const slidUp = await slideImageUp(context, contextSize);
+  const falVertical = await callFal(slidUp, contextSize, signal);
+  const bottomBand = await extractBottomThird(falVertical, contextSize);
 
-  workingBuffer = await compositeBottomSegment(workingBuffer, bottomBand, 0, finalHeight);
+  segments.push({ buffer: bottomBand, left: 0 });
+  trace.record('down_vertical', { slid: slidUp, fal: falVertical, band: bottomBand });
 
   steps.push({
-    iteration: steps.length + 1,
     direction: 'down',
     stage: 'vertical',
     column: bottomBand,
   });
 
   context = falVertical;
-  const bottomBandMeta = await sharp(bottomBand).metadata();
-  let currentOffset = Math.min(bottomBandMeta.width || blockWidth, finalWidth);
+  let currentOffset = blockWidth;
 
   while (currentOffset < finalWidth) {
-    const slid = await slideImageLeft(context);
-    const slidMeta = await sharp(slid).metadata();
-    const horizontalExpected = { width: slidMeta.width || 0, height: slidMeta.height || 0 };
-    const falHorizontal = await callFal(slid, horizontalExpected);
-    const newColumn = await extractRightThird(falHorizontal);
-    const bottomTile = await extractBottomTile(newColumn, tileHeight);
-    const bottomTileMeta = await sharp(bottomTile).metadata();
-
-    workingBuffer = await compositeBottomSegment(workingBuffer, bottomTile, currentOffset, finalHeight);
+    const slid = await slideImageLeft(context, contextSize);
+    const falHorizontal = await callFal(slid, contextSize, signal);
+    const bottomTile = await extractBottomRightTile(falHorizontal, tileHeight, contextSize);
+
+    segments.push({ buffer: bottomTile, left: currentOffset });
+    trace.record(`down_horizontal_${String(steps.length).padStart(2, '0')}`, {
+      slid,
+      fal: falHorizontal,
+      tile: bottomTile,
+    });
 
     steps.push({
-      iteration: steps.length + 1,
       direction: 'down',
       stage: 'horizontal',
       column: bottomTile,
     });
 
     context = falHorizontal;
-    const availableWidth = Math.max(0, finalWidth - currentOffset);
-    const increment = Math.min(bottomTileMeta.width || tileWidth, availableWidth);
-    if (!increment) {
-      break;
-    }
-    currentOffset += increment;
+    currentOffset += tileStride;
   }
 
-  return workingBuffer;
+  return { segments, height: tileHeight, steps };
 }
 
-async function appendColumn(baseBuffer, columnBuffer) {
-  const baseImage = sharp(baseBuffer);
-  const columnImage = sharp(columnBuffer);
+// Mismatched sizes are usually FAL rounding by a few pixels; bilinear is
+// indistinguishable there and much cheaper than the default Lanczos, which is
+// kept for genuine rescales.
+function resizeKernel(from, to) {
+  const smallDelta =
+    Math.abs(from.width - to.width) <= to.width * RESIZE_SMALL_DELTA &&
+    Math.abs(from.height - to.height) <= to.height * RESIZE_SMALL_DELTA;
+  return smallDelta ? sharp.kernel.linear : sharp.kernel.lanczos3;
+}
 
-  const [baseMeta, columnMeta] = await Promise.all([
-    baseImage.metadata(),
-    columnImage.metadata(),
-  ]);
+async function layoutColumns(baseMeta, columns, start = baseMeta.width) {
+  const overlays = [];
+  let left = start;
 
-  if (!baseMeta.width || !baseMeta.height) {
-    throw new Error('Invalid base image dimensions');
-  }
-  if (!columnMeta.width || !columnMeta.height) {
-    throw new Error('Invalid column image dimensions');
-  }
+  for (const column of columns) {
+    let { data, info } = column;
+    if (!info.width || !info.height) {
+      throw new Error('Invalid column image dimensions');
+    }
 
-  let adjustedColumnBuffer = columnBuffer;
-  let adjustedColumnMeta = columnMeta;
+    if (info.height !== baseMeta.height) {
+      ({ data, info } = await sharp(data, { raw: info })
+        .resize({
+          width: info.width,
+          height: baseMeta.height,
+          fit: 'fill',
+          kernel: resizeKernel(info, { width: info.width, height: baseMeta.height }),
+        })
+        .raw()
+        .toBuffer({ resolveWithObject: true }));
+    }
 
-  if (columnMeta.height !== baseMeta.height) {
-    adjustedColumnBuffer = await columnImage
-      .resize({
-        width: columnMeta.width,
-        height: baseMeta.height,
-        fit: 'fill',
-      })
-      .png()
-      .toBuffer();
-    adjustedColumnMeta = await sharp(adjustedColumnBuffer).metadata();
+    overlays.push({
+      input: data,
+      raw: { width: info.width, height: info.height, channels: info.channels },
+      left,
+      top: 0,
+    });
+    left += info.width;
   }
 
-  const newWidth = baseMeta.width + (adjustedColumnMeta.width || 0);
-
-  return createWhiteBackground(newWidth, baseMeta.height)
-    .composite([
-      { input: baseBuffer, left: 0, top: 0 },
-      { input: adjustedColumnBuffer, left: baseMeta.width, top: 0 },
-    ])
-    .png()
-    .toBuffer();
+  return { overlays, width: left };
 }
 
-async function prependColumn(baseBuffer, columnBuffer) {
+async function prependColumns(baseBuffer, columns) {
   const baseImage = sharp(baseBuffer);
-  const columnImage = sharp(columnBuffer);
-
-  const [baseMeta, columnMeta] = await Promise.all([
-    baseImage.metadata(),
-    columnImage.metadata(),
-  ]);
+  const baseMeta = await baseImage.metadata();
 
   if (!baseMeta.width || !baseMeta.height) {
     throw new Error('Invalid base image dimensions');
   }
-  if (!columnMeta.width || !columnMeta.height) {
-    throw new Error('Invalid column image dimensions');
-  }
 
-  let adjustedColumnBuffer = columnBuffer;
-  let adjustedColumnMeta = columnMeta;
+  const { overlays, width } = await layoutColumns(baseMeta, columns, 0);
 
-  if (columnMeta.height !== baseMeta.height) {
-    adjustedColumnBuffer = await columnImage
-      .resize({
-        width: columnMeta.width,
-        height: baseMeta.height,
-        fit: 'fill',
-      })
-      .png()
-      .toBuffer();
-    adjustedColumnMeta = await sharp(adjustedColumnBuffer).metadata();
+  // Grow the base once for every column and composite them in one pass,
+  // rather than re-encoding the ever wider canvas after each column.
+  return baseImage
+    .extend({ left: width, background: WHITE })
+    .composite(overlays)
+    .png(INTERMEDIATE_PNG_OPTIONS)
+    .toBuffer({ resolveWithObject: true });
+}
+
+function isRetryableError(error) {
+  const status = error?.status;
+  if (typeof status === 'number') {
+    return status === 408 || status === 429 || status >= 500;
   }
+  const code = error?.code || error?.cause?.code;
+  return (
+    error instanceof TypeError ||
+    error?.name === 'TimeoutError' ||
+    RETRYABLE_NETWORK_CODES.includes(code)
+  );
+}
 
-  const columnWidth = adjustedColumnMeta.width || 0;
-  const newWidth = columnWidth + baseMeta.width;
+function sleep(ms, signal) {
+  return new Promise((resolve, reject) => {
+    if (signal?.aborted) {
+      reject(signal.reason);
+      return;
+    }
+    const onAbort = () => {
+      clearTimeout(timer);
+      reject(signal.reason);
+    };
+    const timer = setTimeout(() => {
+      signal?.removeEventListener('abort', onAbort);
+      resolve();
+    }, ms);
+    signal?.addEventListener('abort', onAbort, { once: true });
+  });
+}
 
-  return createWhiteBackground(newWidth, baseMeta.height)
-    .composite([
-      { input: adjustedColumnBuffer, left: 0, top: 0 },
-      { input: baseBuffer, left: columnWidth, top: 0 },
-    ])
-    .png()
-    .toBuffer();
+// Stops as soon as `signal` is aborted, both between attempts and mid-backoff,
+// so a cancelled request does not keep refetching.
+async function withRetry(label, operation, signal) {
+  for (let attempt = 1; ; attempt += 1) {
+    signal?.throwIfAborted();
+    try {
+      return await operation();
+    } catch (error) {
+      if (signal?.aborted || attempt >= RETRY_ATTEMPTS || !isRetryableError(error)) {
+        throw error;
+      }
+      // Full-jitter exponential backoff, unless the server told us how long to
+      // wait; a Retry-After is still capped so it cannot stall the request.
+      const backoff = Math.min(RETRY_MAX_DELAY_MS, RETRY_BASE_DELAY_MS * 2 ** (attempt - 1));
+      const delay = error.retryAfterMs != null
+        ? Math.min(RETRY_MAX_DELAY_MS, error.retryAfterMs)
+        : Math.round(Math.random() * backoff);
+      console.warn(`${label} failed (attempt ${attempt}/${RETRY_ATTEMPTS}): ${error.message}. Retrying in ${delay}ms`);
+      await sleep(delay, signal);
+    }
+  }
 }
 
-async function downloadImageBuffer(url) {
+async function downloadImageBuffer(url, signal) {
   if (url.startsWith('data:')) {
-    const [, dataPart] = url.split(',');
-    return Buffer.from(dataPart, 'base64');
+    return Buffer.from(url.slice(url.indexOf(',') + 1), 'base64');
   }
-  const response = await fetch(url);
+  const timeout = AbortSignal.timeout(DOWNLOAD_TIMEOUT_MS);
+  const response = await fetch(url, { signal: signal ? AbortSignal.any([signal, timeout]) : timeout });
   if (!response.ok) {
-    throw new Error(`Failed to download image: ${response.status}`);
+    const error = new Error(`Failed to download image: ${response.status}`);
+    error.status = response.status;
+    const retryAfter = Number.parseInt(response.headers.get('retry-after'), 10);
+    if (Number.isFinite(retryAfter)) {
+      error.retryAfterMs = retryAfter * 1000;
+    }
+    throw error;
   }
   const arrayBuffer = await response.arrayBuffer();
   return Buffer.from(arrayBuffer);
 }
 
-async function generateSeedFromPrompt(promptText) {
+// Single entry point for every FAL image model call, so both endpoints share
+// the configured client, the credentials check and the download retries.
+async function runFalImageModel(label, modelId, input, signal) {
   if (!process.env.FAL_KEY) {
     throw new Error('FAL_KEY is not configured');
   }
 
-  const result = await fal.subscribe(TEXT_TO_IMAGE_MODEL, {
-    input: {
-      prompt: promptText,
-      aspect_ratio: '1:1',
-      num_images: 1,
-      enable_safety_checker: true,
-      output_format: 'png',
-      sync_mode: true,
-    },
-    logs: true,
-  });
+  const result = await fal.subscribe(modelId, { input, logs: true, abortSignal: signal });
 
   const images = result?.data?.images || result?.images || [];
   if (!images.length || !images[0].url) {
-    throw new Error('FAL text-to-image returned no image');
+    throw new Error(`${label} returned no images`);
   }
 
-  const buffer = await downloadImageBuffer(images[0].url);
-  const pngBuffer = await sharp(buffer).toColourspace('srgb').png().toBuffer();
-  const metadata = await sharp(pngBuffer).metadata();
+  const { url } = images[0];
+  const buffer = await withRetry('FAL download', () => downloadImageBuffer(url, signal), signal);
+  return { result, url, buffer };
+}
+
+async function generateSeedFromPrompt(promptText) {
+  const { result, buffer } = await runFalImageModel('FAL text-to-image', TEXT_TO_IMAGE_MODEL, {
+    prompt: promptText,
+    aspect_ratio: '1:1',
+    num_images: 1,
+    enable_safety_checker: true,
+    output_format: 'png',
+    sync_mode: true,
+  });
+
+  const image = sharp(buffer);
+  let metadata = await image.metadata();
+  let pngBuffer = buffer;
+  if (!isRgbPng(metadata)) {
+    pngBuffer = await image.toColourspace('srgb').png().toBuffer();
+    metadata = await sharp(pngBuffer).metadata();
+  }
 
   return {
     buffer: pngBuffer,
@@ -488,121 +565,398 @@ async function generateSeedFromPrompt(promptText) {
   };
 }
 
-async function callFal(slidBuffer, expectedSize) {
-  if (!process.env.FAL_KEY) {
-    throw new Error('FAL_KEY is not configured');
+function falCacheKey(slidBuffer, expectedSize) {
+  return crypto
+    .createHash('sha256')
+    .update(slidBuffer)
+    .update(
+      JSON.stringify({
+        model: MODEL_ID,
+        prompt: PROMPT,
+        lora: LORA_URL,
+        steps: NUM_INFERENCE_STEPS,
+        guidance: GUIDANCE_SCALE,
+        acceleration: ACCELERATION,
+        resolution: RESOLUTION_MODE,
+        format: OUTPUT_FORMAT,
+        width: expectedSize.width,
+        height: expectedSize.height,
+      }),
+    )
+    .digest('hex');
+}
+
+async function readFalCache(key) {
+  if (FAL_CACHE_MODE !== 'enabled' && FAL_CACHE_MODE !== 'replay') {
+    return null;
+  }
+
+  for (const extension of ['jpg', 'png']) {
+    try {
+      return await fs.promises.readFile(path.join(FAL_CACHE_DIR, `${key}.${extension}`));
+    } catch (error) {
+      if (error.code === 'ENOENT') {
+        continue;
+      }
+      // Only replay runs depend on the cache; otherwise an unreadable entry
+      // is just a miss and the request goes to FAL as usual.
+      if (FAL_CACHE_MODE === 'replay') {
+        throw error;
+      }
+      console.warn(`Failed to read FAL cache ${key}: ${error.message}`);
+      return null;
+    }
+  }
+
+  if (FAL_CACHE_MODE === 'replay') {
+    throw new Error(`FAL cache miss for ${key} in replay mode`);
+  }
+  return null;
+}
+
+const createdDirectories = new Map();
+
+function ensureDirectory(directory) {
+  let pending = createdDirectories.get(directory);
+  if (!pending) {
+    pending = fs.promises.mkdir(directory, { recursive: true });
+    pending.catch(() => createdDirectories.delete(directory));
+    createdDirectories.set(directory, pending);
   }
+  return pending;
+}
+
+async function writeFileAtomic(filePath, data) {
+  const tempPath = `${filePath}.${process.pid}.${crypto.randomBytes(6).toString('hex')}.tmp`;
+  await fs.promises.writeFile(tempPath, data);
+  await fs.promises.rename(tempPath, filePath);
+}
+
+function imageExtension(buffer) {
+  return buffer[0] === 0xff && buffer[1] === 0xd8 ? 'jpg' : 'png';
+}
 
-  const blob = new Blob([slidBuffer], { type: 'image/png' });
-  const uploadUrl = await fal.storage.upload(blob);
-
-  const result = await fal.subscribe(MODEL_ID, {
-    input: {
-      prompt: PROMPT,
-      image_url: uploadUrl,
-      num_inference_steps: NUM_INFERENCE_STEPS,
-      guidance_scale: GUIDANCE_SCALE,
-      num_images: 1,
-      enable_safety_checker: true,
-      output_format: OUTPUT_FORMAT,
-      loras: [{ path: LORA_URL, scale: 1 }],
-      acceleration: ACCELERATION,
-      resolution_mode: RESOLUTION_MODE,
-      sync_mode: true,
+function createTraceRecorder() {
+  if (!TRACE_DIR) {
+    return { record() {}, async flush() {} };
+  }
+
+  const runId = `${new Date().toISOString().replace(/[:.]/g, '-')}-${crypto.randomBytes(3).toString('hex')}`;
+  const runDirectory = path.join(TRACE_DIR, runId);
+  const pending = new Set();
+  // Created once per run here rather than through ensureDirectory, whose
+  // memo is meant for a handful of fixed directories, not one per request.
+  let runDirectoryReady = null;
+  const ensureRunDirectory = () => {
+    if (!runDirectoryReady) {
+      runDirectoryReady = fs.promises.mkdir(runDirectory, { recursive: true });
+      runDirectoryReady.catch(() => {
+        runDirectoryReady = null;
+      });
+    }
+    return runDirectoryReady;
+  };
+
+  return {
+    // Writes are fired off in the background so they never hold up the next
+    // FAL call; flush() waits for whatever is still in flight.
+    record(label, artefacts) {
+      for (const [name, buffer] of Object.entries(artefacts)) {
+        if (!buffer) {
+          continue;
+        }
+        const write = ensureRunDirectory()
+          .then(() => fs.promises.writeFile(path.join(runDirectory, `${label}_${name}.${imageExtension(buffer)}`), buffer))
+          .catch((error) => console.warn(`Failed to write trace ${label}_${name}: ${error.message}`))
+          .finally(() => pending.delete(write));
+        pending.add(write);
+      }
     },
-    logs: true,
-  });
+    async flush() {
+      await Promise.all(pending);
+    },
+  };
+}
 
-  const images = result?.data?.images || [];
-  if (!images.length || !images[0].url) {
-    throw new Error('FAL API returned no images');
+async function writeFalCache(key, buffer, metadata) {
+  if (FAL_CACHE_MODE !== 'enabled' && FAL_CACHE_MODE !== 'write-only') {
+    return;
+  }
+
+  // The FAL call has already been paid for, so a cache that cannot be written
+  // (read-only or full disk) must not fail the request.
+  try {
+    await ensureDirectory(FAL_CACHE_DIR);
+    await writeFileAtomic(path.join(FAL_CACHE_DIR, `${key}.json`), JSON.stringify(metadata, null, 2));
+    await writeFileAtomic(path.join(FAL_CACHE_DIR, `${key}.${imageExtension(buffer)}`), buffer);
+  } catch (error) {
+    console.warn(`Failed to write FAL cache ${key}: ${error.message}`);
+  }
+}
+
+// Upload URLs keyed by content hash, so re-running a request (or a step) with
+// identical context bytes does not push the same image to FAL storage again.
+// In-flight uploads are shared; failed ones are dropped so they can be retried.
+const uploadCache = new Map();
+
+function uploadImage(buffer, contentType) {
+  const key = crypto.createHash('sha256').update(buffer).digest('hex');
+  const cached = uploadCache.get(key);
+  if (cached) {
+    return cached;
+  }
+
+  const upload = fal.storage.upload(new Blob([buffer], { type: contentType }));
+  upload.catch(() => uploadCache.delete(key));
+  uploadCache.set(key, upload);
+  if (uploadCache.size > UPLOAD_CACHE_LIMIT) {
+    uploadCache.delete(uploadCache.keys().next().value);
   }
+  return upload;
+}
 
-  const downloadedBuffer = await downloadImageBuffer(images[0].url);
-  let image = sharp(downloadedBuffer).toColourspace('srgb');
+async function callFal(slidBuffer, expectedSize, signal) {
+  signal?.throwIfAborted();
+  const cacheKey = falCacheKey(slidBuffer, expectedSize);
+  const cached = await readFalCache(cacheKey);
+  if (cached) {
+    return cached;
+  }
+
+  if (!process.env.FAL_KEY) {
+    throw new Error('FAL_KEY is not configured');
+  }
+
+  const uploadUrl = await uploadImage(slidBuffer, 'image/jpeg');
+
+  const { result, url, buffer: downloadedBuffer } = await runFalImageModel('FAL inference', MODEL_ID, {
+    prompt: PROMPT,
+    image_url: uploadUrl,
+    num_inference_steps: NUM_INFERENCE_STEPS,
+    guidance_scale: GUIDANCE_SCALE,
+    num_images: 1,
+    enable_safety_checker: true,
+    output_format: OUTPUT_FORMAT,
+    loras: [{ path: LORA_URL, scale: 1 }],
+    acceleration: ACCELERATION,
+    resolution_mode: RESOLUTION_MODE,
+    sync_mode: true,
+  }, signal);
+
+  const image = sharp(downloadedBuffer);
   const meta = await image.metadata();
 
   const expectedWidth = expectedSize.width;
   const expectedHeight = expectedSize.height;
 
+  let output = downloadedBuffer;
   if (meta.width !== expectedWidth || meta.height !== expectedHeight) {
-    image = image.resize({
-      width: expectedWidth,
-      height: expectedHeight,
-      fit: 'fill',
-    });
+    output = await image
+      .toColourspace('srgb')
+      .resize({
+        width: expectedWidth,
+        height: expectedHeight,
+        fit: 'fill',
+        kernel: resizeKernel(meta, expectedSize),
+      })
+      .png(INTERMEDIATE_PNG_OPTIONS)
+      .toBuffer();
+  } else if (meta.space !== 'srgb') {
+    output = await image.toColourspace('srgb').png(INTERMEDIATE_PNG_OPTIONS).toBuffer();
   }
+  // Otherwise the downloaded bytes are already usable as-is; every consumer
+  // decodes them exactly once instead of after a JPEG -> PNG round trip.
+  await writeFalCache(cacheKey, output, {
+    model: MODEL_ID,
+    prompt: PROMPT,
+    lora: LORA_URL,
+    requestId: result?.requestId ?? null,
+    url: url.startsWith('data:') ? null : url,
+    width: expectedWidth,
+    height: expectedHeight,
+    createdAt: new Date().toISOString(),
+  });
 
-  return image.png().toBuffer();
+  return output;
 }
 
-async function extendSeed(buffer, iterations = ITERATIONS, extendBottom = false) {
-  const seedBuffer = await ensureRgbPng(buffer);
+async function extendRightChain(seedBuffer, expectedSize, iterations, trace, signal) {
+  const columns = [];
   const steps = [];
-
-  const seedMeta = await sharp(seedBuffer).metadata();
-  const expectedSize = { width: seedMeta.width || 0, height: seedMeta.height || 0 };
-
-  const rightColumns = [];
-  let rightContextBuffer = seedBuffer;
-  let rightAccumulated = seedBuffer;
-
-  for (let index = 0; index < iterations; index += 1) {
-    const slidBuffer = await slideImageLeft(rightContextBuffer);
-    const falBuffer = await callFal(slidBuffer, expectedSize);
-    const newColumnBuffer = await extractRightThird(falBuffer);
-    rightAccumulated = await appendColumn(rightAccumulated, newColumnBuffer);
-    rightContextBuffer = falBuffer;
-    rightColumns.push(newColumnBuffer);
+  let contextBuffer = seedBuffer;
+  let pendingStep = null;
+
+  // Only the FAL result feeds the next iteration. Extracting the column for
+  // step N therefore runs while the FAL call for step N + 1 is in flight
+  // instead of in front of it. Columns are stitched once by extendSeed, so
+  // no ever-growing canvas is re-encoded per step.
+  const finishStep = async (index, slidBuffer, falBuffer) => {
+    const newColumn = await extractRightThird(falBuffer, expectedSize);
+    trace.record(`right_${String(index + 1).padStart(2, '0')}`, { slid: slidBuffer, fal: falBuffer });
+    columns.push(newColumn);
 
     steps.push({
-      iteration: steps.length + 1,
       direction: 'right',
       slid: slidBuffer,
       fal: falBuffer,
-      column: newColumnBuffer,
-      extended: rightAccumulated,
     });
+  };
+
+  for (let index = 0; index < iterations; index += 1) {
+    let slidBuffer = null;
+    const [falBuffer] = await Promise.all([
+      slideImageLeft(contextBuffer, expectedSize).then((slid) => {
+        slidBuffer = slid;
+        return callFal(slid, expectedSize, signal);
+      }),
+      pendingStep,
+    ]);
+    pendingStep = finishStep(index, slidBuffer, falBuffer);
+    contextBuffer = falBuffer;
   }
+  await pendingStep;
 
-  const leftColumns = [];
-  let leftContextBuffer = seedBuffer;
-  let leftAccumulated = seedBuffer;
+  return { columns, steps };
+}
 
-  for (let index = 0; index < iterations; index += 1) {
-    const slidBuffer = await slideImageRight(leftContextBuffer);
-    const falBuffer = await callFal(slidBuffer, expectedSize);
-    const newColumnBuffer = await extractLeftThird(falBuffer);
-    leftAccumulated = await prependColumn(leftAccumulated, newColumnBuffer);
-    leftContextBuffer = falBuffer;
-    leftColumns.unshift(newColumnBuffer);
+async function extendLeftChain(seedBuffer, expectedSize, iterations, trace, signal) {
+  const columns = [];
+  const steps = [];
+  let contextBuffer = seedBuffer;
+  let pendingStep = null;
+
+  // Pipelined the same way as extendRightChain.
+  const finishStep = async (index, slidBuffer, falBuffer) => {
+    const newColumn = await extractLeftThird(falBuffer, expectedSize);
+    trace.record(`left_${String(index + 1).padStart(2, '0')}`, { slid: slidBuffer, fal: falBuffer });
+    columns.unshift(newColumn);
 
     steps.push({
-      iteration: steps.length + 1,
       direction: 'left',
       slid: slidBuffer,
       fal: falBuffer,
-      column: newColumnBuffer,
-      extended: leftAccumulated,
     });
-  }
+  };
 
-  let finalBuffer = leftAccumulated;
-  for (const columnBuffer of rightColumns) {
-    finalBuffer = await appendColumn(finalBuffer, columnBuffer);
+  for (let index = 0; index < iterations; index += 1) {
+    let slidBuffer = null;
+    const [falBuffer] = await Promise.all([
+      slideImageRight(contextBuffer, expectedSize).then((slid) => {
+        slidBuffer = slid;
+        return callFal(slid, expectedSize, signal);
+      }),
+      pendingStep,
+    ]);
+    pendingStep = finishStep(index, slidBuffer, falBuffer);
+    contextBuffer = falBuffer;
   }
+  await pendingStep;
 
-  const leftMeta = await sharp(leftAccumulated).metadata();
-  if (extendBottom) {
-    finalBuffer = await extendBottomRow(finalBuffer, seedMeta, steps);
-  }
+  // The left-hand canvas is needed by the bottom row and the final stitch,
+  // so it is assembled here, once, from all of the columns.
+  const { data: accumulated, info: accumulatedSize } = await prependColumns(seedBuffer, columns);
+  trace.record('left_extended', { image: accumulated });
 
-  const leftExtensionWidth = Math.max(
-    0,
-    (leftMeta.width || 0) - (seedMeta.width || 0),
-  );
+  return { columns, accumulated, accumulatedSize, steps };
+}
 
-  return { seed: seedBuffer, extended: finalBuffer, steps, leftExtensionWidth };
+async function extendSeed(buffer, iterations = ITERATIONS, extendBottom = false) {
+  const seedBuffer = await ensureRgbPng(buffer);
+  const steps = [];
+  const trace = createTraceRecorder();
+  trace.record('seed', { image: seedBuffer });
+  const controller = new AbortController();
+  const { signal } = controller;
+
+  // Flushed even on failure so the trace of a broken run is complete.
+  try {
+    const seedMeta = await sharp(seedBuffer).metadata();
+    const expectedSize = { width: seedMeta.width || 0, height: seedMeta.height || 0 };
+
+    // The left and right chains only depend on the seed, so their FAL calls can
+    // run concurrently. The bottom row only needs the left-most block of the
+    // top row, which is final as soon as the left chain is done, so it overlaps
+    // the rest of the right chain. Steps are merged afterwards in the original
+    // right, left, down order to keep numbering stable.
+    const rightColumnWidth = expectedSize.width - Math.floor((2 * expectedSize.width) / 3);
+    const rightPromise = extendRightChain(seedBuffer, expectedSize, iterations, trace, signal);
+    const leftPromise = extendLeftChain(seedBuffer, expectedSize, iterations, trace, signal);
+    const bottomPromise = extendBottom
+      ? leftPromise.then((chain) => {
+        const finalWidth = chain.accumulatedSize.width + Math.max(0, iterations) * rightColumnWidth;
+        return extendBottomRow(chain.accumulated, finalWidth, seedMeta, trace, signal, chain.accumulatedSize);
+      })
+      : null;
+
+    // Promise.all rejects on the first failure, but the other chains would keep
+    // paying for FAL calls after the response is gone; cancel them instead.
+    let rightChain;
+    let leftChain;
+    let bottomRow;
+    try {
+      [rightChain, leftChain, bottomRow] = await Promise.all([rightPromise, leftPromise, bottomPromise]);
+    } catch (error) {
+      controller.abort(error);
+      throw error;
+    }
+
+    for (const step of [...rightChain.steps, ...leftChain.steps, ...(bottomRow?.steps || [])]) {
+      steps.push({ iteration: steps.length + 1, ...step });
+    }
+
+    // Assemble the whole world in a single pass: grow the left chain's canvas
+    // once and drop every right column and bottom tile straight into it, so no
+    // intermediate full-size canvas is ever encoded.
+    const leftAccumulated = leftChain.accumulated;
+    const leftMeta = leftChain.accumulatedSize;
+
+    const { overlays, width: finalWidth } = await layoutColumns(leftMeta, rightChain.columns);
+    const bandHeight = bottomRow ? bottomRow.height : 0;
+
+    for (const segment of bottomRow?.segments || []) {
+      const overlay = await bottomSegmentOverlay(
+        segment.buffer,
+        segment.left,
+        leftMeta.height,
+        finalWidth,
+        leftMeta.height + bandHeight,
+      );
+      if (overlay) {
+        overlays.push(overlay);
+      }
+    }
+
+    const finalHeight = leftMeta.height + bandHeight;
+    const fitsJpeg = finalWidth <= JPEG_MAX_DIMENSION && finalHeight <= JPEG_MAX_DIMENSION;
+    const canvas = sharp(leftAccumulated)
+      .extend({
+        right: finalWidth - leftMeta.width,
+        bottom: bandHeight,
+        background: WHITE,
+      })
+      .composite(overlays);
+    const extendedBuffer = await (fitsJpeg ? canvas.jpeg(OUTPUT_JPEG_OPTIONS) : canvas.png()).toBuffer();
+    trace.record('final', { image: extendedBuffer });
+
+    const leftExtensionWidth = Math.max(
+      0,
+      (leftMeta.width || 0) - (seedMeta.width || 0),
+    );
+
+    // Sizes are returned alongside the buffers so callers never decode headers
+    // the pipeline already knows.
+    return {
+      seed: seedBuffer,
+      seedSize: expectedSize,
+      extended: extendedBuffer,
+      extendedSize: { width: finalWidth, height: finalHeight },
+      extendedMime: fitsJpeg ? 'image/jpeg' : 'image/png',
+      steps,
+      leftExtensionWidth,
+    };
+  } finally {
+    await trace.flush();
+  }
 }
 
 function toDataUrl(buffer, mime = 'image/png') {
@@ -641,19 +995,16 @@ app.post('/api/extend', upload.single('seed'), async (req, res) => {
     const extendAllDirections = req.body.extendAllDirections === 'true';
     const result = await extendSeed(req.file.buffer, iterations, extendAllDirections);
 
-    const seedMeta = await sharp(result.seed).metadata();
-    const extendedMeta = await sharp(result.extended).metadata();
-
     res.json({
       seed: {
-        width: seedMeta.width,
-        height: seedMeta.height,
+        width: result.seedSize.width,
+        height: result.seedSize.height,
         image: toDataUrl(result.seed),
       },
       extended: {
-        width: extendedMeta.width,
-        height: extendedMeta.height,
-        image: toDataUrl(result.extended),
+        width: result.extendedSize.width,
+        height: result.extendedSize.height,
+        image: toDataUrl(result.extended, result.extendedMime),
         seedOffset: result.leftExtensionWidth,
       },
       steps: result.steps.map((step) => ({